@@ -202,13 +202,9 @@ async def main():
             print(
                 f"Setting {margin_mode} x{exchange_leverage} on {len(pairs)} pairs..."
             )
-            tasks = [
-                exchange.set_margin_mode_and_leverage(
-                    pair, margin_mode, exchange_leverage
-                )
-                for pair in pairs
-            ]
-            await asyncio.gather(*tasks)  # set leverage and margin mode for all pairs
+            await exchange.set_margin_mode_and_leverage_many(
+                pairs, margin_mode, exchange_leverage
+            )  # set leverage and margin mode for all pairs
         except Exception as e:
             print(e)
 
@@ -279,7 +275,7 @@ async def main():
         orders = await asyncio.gather(*tasks)
         order_list = dict(zip(pairs, orders))  # Get all open orders by pair
 
-        tasks = []
+        ids_by_pair = {}
         for pair in df_list:
             params[pair]["canceled_orders_buy"] = params[pair][
                 "canceled_orders_buy"
@@ -299,12 +295,10 @@ async def main():
                     if (order.side == "sell" and order.reduce is False)
                 ]
             )
-            tasks.append(
-                exchange.cancel_orders(pair, [order.id for order in order_list[pair]])
-            )
+            ids_by_pair[pair] = [order.id for order in order_list[pair]]
 
         print(f"Canceling limit orders...")
-        await asyncio.gather(*tasks)  # Cancel all orders
+        await exchange.cancel_orders_many(ids_by_pair)  # Cancel all orders
 
         print(f"Getting live positions...")
         positions = await exchange.get_open_positions(pairs)
@@ -414,10 +408,9 @@ async def main():
         print(f"Placing {len(tasks_close)} close SL / limit order...")
         await asyncio.gather(*tasks_close)  # Limit orders when in positions
 
+        pairs_in_position = {position.pair for position in positions}
         pairs_not_in_position = [
-            pair
-            for pair in pairs
-            if pair not in [position.pair for position in positions]
+            pair for pair in pairs if pair not in pairs_in_position
         ]
         for pair in pairs_not_in_position:
             row = df_list[pair].iloc[-2]
@@ -1,9 +1,17 @@
-from typing import List
+from typing import List, Optional, Union
 import ccxt.async_support as ccxt
+import aiohttp
+import certifi
+import ssl
+import orjson
+from aiolimiter import AsyncLimiter
 import asyncio
+import numpy as np
 import pandas as pd
 import time
+import math
 import itertools
+import functools
 from pydantic import BaseModel
 
 
@@ -60,102 +68,188 @@ class Position(BaseModel):
     stop_loss_price: float
 
 
+def _parse_json(http_response):
+    # Same contract as ccxt's parse_json: non-JSON bodies (empty, HTML error
+    # pages) return None so ccxt can still map the HTTP status to an error.
+    # Bitget sends prices and sizes as JSON strings, so dropping ccxt's
+    # parse_float=str/parse_int=str only affects bare numbers (timestamps,
+    # codes), which fit in 64 bits and decode exactly.
+    try:
+        if ccxt.Exchange.is_json_encoded_object(http_response):
+            return orjson.loads(http_response)
+    except ValueError:
+        pass
+    return None
+
+
 class PerpBitget:
+    _TS_MS = {
+        "1m": 1 * 60 * 1000,
+        "5m": 5 * 60 * 1000,
+        "15m": 15 * 60 * 1000,
+        "1h": 60 * 60 * 1000,
+        "2h": 2 * 60 * 60 * 1000,
+        "4h": 4 * 60 * 60 * 1000,
+        "1d": 24 * 60 * 60 * 1000,
+    }
+    # Bitget accepts at most 50 order ids per batch cancel request
+    _CANCEL_BATCH = 50
+    _MAX_RETRIES = 4
+
     def __init__(self, public_api=None, secret_api=None, password=None):
         bitget_auth_object = {
             "apiKey": public_api,
             "secret": secret_api,
             "password": password,
-            "enableRateLimit": True,
-            "rateLimit": 100,
+            "enableRateLimit": False,
             "options": {
                 "defaultType": "future",
             },
         }
         if bitget_auth_object["secret"] == None:
             self._auth = False
-            self._session = ccxt.bitget()
+            self._session = ccxt.bitget({"enableRateLimit": False})
         else:
             self._auth = True
             self._session = ccxt.bitget(bitget_auth_object)
+        self._session.parse_json = _parse_json
+        self._http_session = None
+        self._semaphore = asyncio.Semaphore(20)
+        self._ohlcv_semaphore = asyncio.Semaphore(8)
+        self._limiter = AsyncLimiter(10, 1)
+        self._amount_to_precision = functools.lru_cache(maxsize=4096)(
+            self._session.amount_to_precision
+        )
+        self._price_to_precision = functools.lru_cache(maxsize=4096)(
+            self._session.price_to_precision
+        )
+
+    async def _bounded(self, coro, semaphore=None):
+        async with semaphore or self._semaphore:
+            return await coro
+
+    async def _call(self, method, *args, **kwargs):
+        # Rate limiting is done here instead of in ccxt so concurrent requests
+        # are not serialized, with exponential backoff when Bitget returns 429
+        for attempt in range(self._MAX_RETRIES):
+            async with self._limiter:
+                try:
+                    return await method(*args, **kwargs)
+                except ccxt.RateLimitExceeded:
+                    if attempt == self._MAX_RETRIES - 1:
+                        raise
+            await asyncio.sleep(0.5 * 2**attempt)
 
     async def load_markets(self):
+        if self._http_session is None and self._session.session is None:
+            # Pooled keep-alive connector, built here so it binds to the running loop
+            connector = aiohttp.TCPConnector(
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                limit=100,
+                limit_per_host=20,
+                keepalive_timeout=75,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True,
+            )
+            self._http_session = aiohttp.ClientSession(connector=connector)
+            self._session.session = self._http_session
         self.market = await self._session.load_markets()
+        self._pair_meta = {
+            self.pair_to_ext_pair(pair): market
+            for pair, market in self.market.items()
+            if pair.endswith(":USDT")
+        }
 
     async def close(self):
         await self._session.close()
+        if self._http_session is not None:
+            await self._http_session.close()
 
-    def ext_pair_to_pair(self, ext_pair) -> str:
-        return f"{ext_pair}:USDT"
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def ext_pair_to_pair(ext_pair) -> str:
+        return ext_pair + ":USDT"
 
-    def pair_to_ext_pair(self, pair) -> str:
-        return pair.replace(":USDT", "")
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def pair_to_ext_pair(pair) -> str:
+        return pair[:-5] if pair.endswith(":USDT") else pair
     
     def get_pair_info(self, ext_pair) -> str:
-        pair = self.ext_pair_to_pair(ext_pair)
-        if pair in self.market:
-            return self.market[pair]
-        else: 
-            return None
+        return self._pair_meta.get(ext_pair)
 
     def amount_to_precision(self, pair: str, amount: float) -> float:
         pair = self.ext_pair_to_pair(pair)
         try:
-            return self._session.amount_to_precision(pair, amount)
+            return self._amount_to_precision(pair, amount)
         except Exception as e:
             return 0
 
     def price_to_precision(self, pair: str, price: float) -> float:
         pair = self.ext_pair_to_pair(pair)
-        return self._session.price_to_precision(pair, price)
+        return self._price_to_precision(pair, price)
 
-    async def get_last_ohlcv(self, pair, timeframe, limit=1000) -> pd.DataFrame:
+    async def get_last_ohlcv(
+        self, pair, timeframe, limit=1000, as_numpy=False
+    ) -> Union[pd.DataFrame, dict]:
         pair = self.ext_pair_to_pair(pair)
         bitget_limit = 200
-        ts_dict = {
-            "1m": 1 * 60 * 1000,
-            "5m": 5 * 60 * 1000,
-            "15m": 15 * 60 * 1000,
-            "1h": 60 * 60 * 1000,
-            "2h": 2 * 60 * 60 * 1000,
-            "4h": 4 * 60 * 60 * 1000,
-            "1d": 24 * 60 * 60 * 1000,
-        }
+        step = bitget_limit * self._TS_MS[timeframe]
         end_ts = int(time.time() * 1000)
-        start_ts = end_ts - ((limit) * ts_dict[timeframe])
-        current_ts = start_ts
+        start_ts = end_ts - ((limit) * self._TS_MS[timeframe])
+        n_batches = math.ceil((end_ts - start_ts) / step)
         tasks = []
-        while current_ts < end_ts:
-            req_end_ts = min(current_ts + (bitget_limit * ts_dict[timeframe]), end_ts)
+        for current_ts in (start_ts + i * step for i in range(n_batches)):
+            # Windows are [current_ts, current_ts + step - 1] so they never overlap
+            req_end_ts = min(current_ts + step - 1, end_ts)
             tasks.append(
-                self._session.fetch_ohlcv(
-                    pair,
-                    timeframe,
-                    params={
-                        "limit": bitget_limit,
-                        "startTime": str(current_ts),
-                        "endTime": str(req_end_ts),
-                    },
+                self._bounded(
+                    self._call(
+                        self._session.fetch_ohlcv,
+                        pair,
+                        timeframe,
+                        params={
+                            "limit": bitget_limit,
+                            "startTime": str(current_ts),
+                            "endTime": str(req_end_ts),
+                        },
+                    ),
+                    self._ohlcv_semaphore,
                 )
             )
-            current_ts += (bitget_limit * ts_dict[timeframe]) + 1
         ohlcv_unpack = await asyncio.gather(*tasks)
         ohlcv_list = list(itertools.chain.from_iterable(ohlcv_unpack))
-        df = pd.DataFrame(
-            ohlcv_list, columns=["date", "open", "high", "low", "close", "volume"]
-        )
-        df = df.set_index(df["date"])
-        df.index = pd.to_datetime(df.index, unit="ms")
-        df = df.sort_index()
-        del df["date"]
+        arr = np.asarray(ohlcv_list, dtype=np.float64).reshape(-1, 6)
+        ts = arr[:, 0].astype(np.int64)
+        if np.any(ts[1:] < ts[:-1]):
+            order = np.argsort(ts, kind="stable")
+            arr, ts = arr[order], ts[order]
+        if np.any(ts[1:] == ts[:-1]):
+            keep = np.append(ts[1:] != ts[:-1], True)
+            arr, ts = arr[keep], ts[keep]
+        values = arr[:, 1:].astype(np.float32)
+        columns = {
+            "open": values[:, 0],
+            "high": values[:, 1],
+            "low": values[:, 2],
+            "close": values[:, 3],
+            "volume": values[:, 4],
+        }
+        if as_numpy:
+            return {"ts": ts, **columns}
+        df = pd.DataFrame(columns, index=pd.to_datetime(ts, unit="ms"))
+        df.index.name = "date"
         return df
 
     async def get_balance(self) -> UsdtBalance:
-        resp = await self._session.fetch_balance()
+        resp = await self._call(self._session.fetch_balance)
+        usdt_data = resp.get("USDT")
+        if usdt_data is None:
+            raise Exception("No USDT balance found in account")
         return UsdtBalance(
-            total=resp["USDT"]["total"],
-            free=resp["USDT"]["free"],
-            used=resp["USDT"]["used"],
+            total=usdt_data["total"],
+            free=usdt_data["free"],
+            used=usdt_data["used"],
         )
 
     async def set_margin_mode_and_leverage(self, pair, margin_mode, leverage):
@@ -163,7 +257,8 @@ class PerpBitget:
             raise Exception("Margin mode must be either 'crossed' or 'isolated'")
         pair = self.ext_pair_to_pair(pair)
         try:
-            await self._session.set_margin_mode(
+            await self._call(
+                self._session.set_margin_mode,
                 margin_mode,
                 pair,
                 params={"productType": "USDT-FUTURES", "marginCoin": "USDT"},
@@ -174,7 +269,8 @@ class PerpBitget:
             if margin_mode == "isolated":
                 tasks = []
                 tasks.append(
-                    self._session.set_leverage(
+                    self._call(
+                        self._session.set_leverage,
                         leverage,
                         pair,
                         params={
@@ -185,7 +281,8 @@ class PerpBitget:
                     )
                 )
                 tasks.append(
-                    self._session.set_leverage(
+                    self._call(
+                        self._session.set_leverage,
                         leverage,
                         pair,
                         params={
@@ -197,7 +294,8 @@ class PerpBitget:
                 )
                 await asyncio.gather(*tasks)
             else:
-                await self._session.set_leverage(
+                await self._call(
+                    self._session.set_leverage,
                     leverage,
                     pair,
                     params={"productType": "USDT-FUTURES", "marginCoin": "USDT"},
@@ -210,45 +308,47 @@ class PerpBitget:
             message=f"Margin mode and leverage set to {margin_mode} and {leverage}x",
         )
 
+    async def set_margin_mode_and_leverage_many(
+        self, pairs, margin_mode, leverage
+    ) -> List[Info]:
+        return await asyncio.gather(
+            *[
+                self._bounded(
+                    self.set_margin_mode_and_leverage(pair, margin_mode, leverage)
+                )
+                for pair in pairs
+            ]
+        )
+
     async def get_open_positions(self, pairs) -> List[Position]:
         pairs = [self.ext_pair_to_pair(pair) for pair in pairs]
-        resp = await self._session.fetch_positions(
+        resp = await self._call(
+            self._session.fetch_positions,
             symbols=pairs, params={"productType": "USDT-FUTURES", "marginCoin": "USDT"}
         )
-        return_positions = []
-        for position in resp:
-            liquidation_price = 0
-            take_profit_price = 0
-            stop_loss_price = 0
-            if position["liquidationPrice"]:
-                liquidation_price = position["liquidationPrice"]
-            if position["takeProfitPrice"]:
-                take_profit_price = position["takeProfitPrice"]
-            if position["stopLossPrice"]:
-                stop_loss_price = position["stopLossPrice"]
-
-            return_positions.append(
-                Position(
-                    pair=self.pair_to_ext_pair(position["symbol"]),
-                    side=position["side"],
-                    size=position["contracts"] * position["contractSize"],
-                    usd_size=round(
-                        (position["contracts"] * position["contractSize"])
-                        * position["markPrice"],
-                        2,
-                    ),
-                    entry_price=position["entryPrice"],
-                    current_price=position["markPrice"],
-                    unrealizedPnl=position["unrealizedPnl"],
-                    liquidation_price=liquidation_price,
-                    leverage=position["leverage"],
-                    margin_mode=position["marginMode"],
-                    hedge_mode=position["hedged"],
-                    open_timestamp=position["timestamp"],
-                    take_profit_price=take_profit_price,
-                    stop_loss_price=stop_loss_price,
-                )
+        return_positions = [None] * len(resp)
+        for i, position in enumerate(resp):
+            size = float(position["contracts"]) * float(position["contractSize"])
+            mark_price = position["markPrice"]
+            return_positions[i] = Position.model_construct(
+                pair=self.pair_to_ext_pair(position["symbol"]),
+                side=position["side"],
+                size=size,
+                usd_size=round(size * mark_price, 2),
+                entry_price=position["entryPrice"],
+                current_price=mark_price,
+                unrealizedPnl=position["unrealizedPnl"],
+                liquidation_price=position["liquidationPrice"] or 0,
+                leverage=position["leverage"],
+                margin_mode=position["marginMode"],
+                hedge_mode=position["hedged"],
+                open_timestamp=position["timestamp"],
+                take_profit_price=position["takeProfitPrice"] or 0,
+                stop_loss_price=position["stopLossPrice"] or 0,
             )
+        if return_positions:
+            # Validate one sample so a change in ccxt's payload still fails loudly
+            Position.model_validate(return_positions[0].model_dump())
         return return_positions
 
     async def place_order(
@@ -266,7 +366,8 @@ class PerpBitget:
             pair = self.ext_pair_to_pair(pair)
             trade_side = "Open" if reduce is False else "Close"
             margin_mode = "cross" if margin_mode == "crossed" else "isolated"
-            resp = await self._session.create_order(
+            resp = await self._call(
+                self._session.create_order,
                 symbol=pair,
                 type=type,
                 side=side,
@@ -289,6 +390,11 @@ class PerpBitget:
             else:
                 return None
 
+    async def place_orders(self, orders) -> List[Optional[Order]]:
+        return await asyncio.gather(
+            *[self._bounded(self.place_order(**order)) for order in orders]
+        )
+
     async def place_trigger_order(
         self,
         pair,
@@ -305,7 +411,8 @@ class PerpBitget:
             pair = self.ext_pair_to_pair(pair)
             trade_side = "Open" if reduce is False else "Close"
             margin_mode = "cross" if margin_mode == "crossed" else "isolated"
-            trigger_order = await self._session.create_trigger_order(
+            trigger_order = await self._call(
+                self._session.create_trigger_order,
                 symbol=pair,
                 type=type,
                 side=side,
@@ -329,7 +436,7 @@ class PerpBitget:
 
     async def get_open_orders(self, pair) -> List[Order]:
         pair = self.ext_pair_to_pair(pair)
-        resp = await self._session.fetch_open_orders(pair)
+        resp = await self._call(self._session.fetch_open_orders, pair)
         return_orders = []
         for order in resp:
             return_orders.append(
@@ -350,7 +457,9 @@ class PerpBitget:
 
     async def get_open_trigger_orders(self, pair) -> List[TriggerOrder]:
         pair = self.ext_pair_to_pair(pair)
-        resp = await self._session.fetch_open_orders(pair, params={"stop": True})
+        resp = await self._call(
+            self._session.fetch_open_orders, pair, params={"stop": True}
+        )
         # print(resp)
         return_orders = []
         for order in resp:
@@ -373,7 +482,7 @@ class PerpBitget:
 
     async def get_order_by_id(self, order_id, pair) -> Order:
         pair = self.ext_pair_to_pair(pair)
-        resp = await self._session.fetch_order(order_id, pair)
+        resp = await self._call(self._session.fetch_order, order_id, pair)
         return Order(
             id=resp["id"],
             pair=self.pair_to_ext_pair(resp["symbol"]),
@@ -387,23 +496,59 @@ class PerpBitget:
             timestamp=resp["timestamp"],
         )
 
-    async def cancel_orders(self, pair, ids=[]):
+    async def _cancel_in_chunks(self, pair, ids, label, params=None):
+        params = params or {}
+        chunks = [
+            ids[i : i + self._CANCEL_BATCH]
+            for i in range(0, len(ids), self._CANCEL_BATCH)
+        ]
+        if not chunks:
+            return Info(success=False, message="Error or no orders to cancel")
+        results = await asyncio.gather(
+            *[
+                self._call(
+                    self._session.cancel_orders, ids=chunk, symbol=pair, params=params
+                )
+                for chunk in chunks
+            ],
+            return_exceptions=True,
+        )
+        count = 0
+        failed_ids = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                failed_ids.extend(chunk)
+            else:
+                count += len(result)
+        if failed_ids:
+            return Info(
+                success=False,
+                message=f"{count} {label} cancelled, failed to cancel {failed_ids}",
+            )
+        return Info(success=True, message=f"{count} {label} cancelled")
+
+    async def cancel_orders(self, pair, ids=None):
+        ids = ids or []
         try:
             pair = self.ext_pair_to_pair(pair)
-            resp = await self._session.cancel_orders(
-                ids=ids,
-                symbol=pair,
-            )
-            return Info(success=True, message=f"{len(resp)} Orders cancelled")
+            return await self._cancel_in_chunks(pair, ids, "Orders")
         except Exception as e:
             return Info(success=False, message="Error or no orders to cancel")
 
-    async def cancel_trigger_orders(self, pair, ids=[]):
+    async def cancel_trigger_orders(self, pair, ids=None):
+        ids = ids or []
         try:
             pair = self.ext_pair_to_pair(pair)
-            resp = await self._session.cancel_orders(
-                ids=ids, symbol=pair, params={"stop": True}
+            return await self._cancel_in_chunks(
+                pair, ids, "Trigger Orders", params={"stop": True}
             )
-            return Info(success=True, message=f"{len(resp)} Trigger Orders cancelled")
         except Exception as e:
             return Info(success=False, message="Error or no orders to cancel")
+
+    async def cancel_orders_many(self, ids_by_pair) -> List[Info]:
+        return await asyncio.gather(
+            *[
+                self._bounded(self.cancel_orders(pair, ids))
+                for pair, ids in ids_by_pair.items()
+            ]
+        )